@@ -1,9 +1,17 @@
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+import numpy as np
+import orjson
 import pandas as pd
 import os
 import logging
-from datetime import datetime
-from time import sleep
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -14,21 +22,169 @@ logger = logging.getLogger(__name__)
 API_KEY = os.getenv("API_FOOTBALL_KEY")
 BASE_URL = "https://v3.football.api-sports.io"
 LEAGUE_ID = 39        # Premier League
-SEASON = datetime.now().year - 1 if datetime.now().month < 8 else datetime.now().year
+
+def current_season(now=None):
+    """Return the season start year; seasons roll over in August."""
+    now = now or datetime.now(timezone.utc)
+    return now.year - 1 if now.month < 8 else now.year
 
 HEADERS = {
     "x-apisports-key": API_KEY
 }
 
+CACHE_DIR = os.path.expanduser(os.getenv("FOOTBALL_CACHE_DIR", "~/.footballpipe"))
+CACHE_NAME = os.path.join(CACHE_DIR, "football_cache")
+CACHE_EXPIRE_SECONDS = 3600
+DEFAULT_RETRY_AFTER = 60    # Seconds to wait on 429 without a Retry-After header
+RATE_LIMIT_MIN_REMAINING = 2
+RATE_LIMIT_PER_MINUTE = 10  # API-Sports free tier quota
+
+# =========================
+# HTTP SESSION
+# =========================
+# Matches an empty errors array however the JSON is spaced
+_EMPTY_ERRORS = re.compile(rb'"errors"\s*:\s*\[\s*\]')
+
+def _is_cacheable(response):
+    """Only cache bodies that carry data, never API-level error payloads."""
+    # A byte probe instead of a decode: api_get parses the body once itself
+    return response.status_code == 200 and _EMPTY_ERRORS.search(response.content) is not None
+
+# Shared session, built on first use so importing this module does not touch
+# the cache directory
+_SESSION = None
+_session_lock = threading.Lock()
+
+def _get_session():
+    """Return the shared session, creating it on first call.
+    
+    Every endpoint reuses the same pooled TCP/TLS connection. Responses are
+    cached on disk (JSON, not pickle) and served stale if the API errors out;
+    the API key is redacted from stored requests. Expired entries are kept
+    and revalidated with If-None-Match/If-Modified-Since, so an unchanged
+    endpoint answers 304 and the stored body is reused.
+    """
+    global _SESSION
+    with _session_lock:
+        if _SESSION is None:
+            session = requests_cache.CachedSession(
+                CACHE_NAME,
+                backend="sqlite",
+                serializer="json",
+                expire_after=CACHE_EXPIRE_SECONDS,
+                allowable_codes=(200,),
+                stale_if_error=True,
+                ignored_parameters=["x-apisports-key"],
+                filter_fn=_is_cacheable
+            )
+            session.headers.update(HEADERS)
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            _SESSION = session
+    return _SESSION
+
+def _cached_fallback(response):
+    """Return the last good cached body for a request the API refused."""
+    cache = _get_session().cache
+    cached = cache.get_response(cache.create_key(response.request))
+    if cached is None:
+        return None
+    
+    logger.warning("Serving last cached response for %s", response.request.url)
+    return orjson.loads(cached.content).get("response")
+
 # =========================
 # VALIDATION
 # =========================
+_key_checked = False
+
 def validate_api_key():
     """Validate API key exists."""
     if not API_KEY:
         raise ValueError("API_FOOTBALL_KEY environment variable not set")
     logger.info(f"API Key configured: {API_KEY[:10]}...")
 
+# =========================
+# RATE LIMIT HELPERS
+# =========================
+class TokenBucket:
+    """Thread-safe token bucket that paces requests under a fixed quota."""
+    
+    def __init__(self, capacity, refill_per_sec):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = monotonic()
+                elapsed = now - self._updated
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_sec)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                wait = (1 - self._tokens) / self.refill_per_sec
+            
+            logger.info("Client-side rate limit reached, waiting %.1fs", wait)
+            sleep(wait)
+
+_bucket = TokenBucket(
+    capacity=RATE_LIMIT_PER_MINUTE,
+    refill_per_sec=RATE_LIMIT_PER_MINUTE / 60.0
+)
+
+def _jittered(seconds):
+    """Stretch a wait by up to 30% so concurrent retries don't line up."""
+    return seconds * (1 + random.random() * 0.3)
+
+def _retry_after_seconds(response):
+    """Seconds to wait from a Retry-After header (delta or HTTP-date)."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _pace_rate_limit(response):
+    """Wait for the quota window to reset when the API says we are nearly out."""
+    if getattr(response, "from_cache", False):
+        return
+    
+    try:
+        remaining = int(response.headers["X-RateLimit-Remaining"])
+        reset = float(response.headers["X-RateLimit-Reset"])
+    except (KeyError, ValueError):
+        return
+    
+    if remaining >= RATE_LIMIT_MIN_REMAINING:
+        return
+    
+    # Reset is sent either as an epoch timestamp or as seconds until reset
+    if reset > 86400:
+        wait = reset - datetime.now(timezone.utc).timestamp()
+    else:
+        wait = reset
+    if wait > 0:
+        logger.info("%d requests left in quota window, waiting %.1fs", remaining, wait)
+        sleep(_jittered(wait))
+
 # =========================
 # API HELPER WITH RETRY LOGIC
 # =========================
@@ -44,65 +200,85 @@ def api_get(endpoint, params=None, max_retries=3):
     Returns:
         Response data or None if failed
     """
+    # Checked on first use so importing this module has no side effects
+    global _key_checked
+    if not _key_checked:
+        validate_api_key()
+        _key_checked = True
+    session = _get_session()
+    
     url = f"{BASE_URL}{endpoint}"
     
     for attempt in range(max_retries):
         try:
-            logger.info(f"API Request: {endpoint} (Attempt {attempt + 1}/{max_retries})")
-            response = requests.get(url, headers=HEADERS, params=params, timeout=10)
+            logger.info("API Request: %s (Attempt %d/%d)", endpoint, attempt + 1, max_retries)
+            _bucket.acquire()
+            response = session.get(url, params=params, timeout=10)
             
             # Check for rate limiting
             if response.status_code == 429:
-                logger.warning(f"Rate limit exceeded. Waiting 60 seconds...")
-                sleep(60)
+                wait = _retry_after_seconds(response)
+                logger.warning("Rate limit exceeded. Waiting %.0f seconds...", wait)
+                if attempt < max_retries - 1:
+                    sleep(_jittered(wait))
                 continue
             
             # Check for other errors
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Validate response structure
             if "response" not in data:
-                logger.error(f"Invalid API response structure: {data}")
+                logger.error("Invalid API response structure: %s", data)
                 return None
             
-            # Check for API errors
+            # Check for API errors; an exhausted key is reported this way with
+            # HTTP 200, so stale_if_error never kicks in and we fall back by hand
             if "errors" in data and data["errors"]:
-                logger.error(f"API returned errors: {data['errors']}")
-                return None
+                logger.error("API returned errors: %s", data["errors"])
+                return _cached_fallback(response)
+            
+            _pace_rate_limit(response)
             
-            logger.info(f"✓ API request successful: {len(data['response'])} results")
+            if getattr(response, "revalidated", False):
+                source = " (not modified)"
+            elif getattr(response, "from_cache", False):
+                source = " (cached)"
+            else:
+                source = ""
+            logger.info("✓ API request successful%s: %d results", source, len(data["response"]))
             return data["response"]
             
         except requests.exceptions.Timeout:
-            logger.warning(f"Request timeout (attempt {attempt + 1}/{max_retries})")
+            logger.warning("Request timeout (attempt %d/%d)", attempt + 1, max_retries)
             if attempt < max_retries - 1:
-                sleep(2 ** attempt)  # Exponential backoff
+                sleep(_jittered(2 ** attempt))  # Exponential backoff
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {str(e)}")
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            logger.error("Request failed: %s", e)
             if attempt < max_retries - 1:
-                sleep(2 ** attempt)
+                sleep(_jittered(2 ** attempt))
             
         except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
+            logger.error("Unexpected error: %s", e)
             return None
     
-    logger.error(f"All retry attempts failed for {endpoint}")
+    logger.error("All retry attempts failed for %s", endpoint)
     return None
 
 # =========================
 # 1. EPL STANDINGS
 # =========================
-def get_standings():
-    """Fetch and parse EPL standings data."""
+def get_standings(season=None):
+    """Fetch and parse EPL standings data for a season (default: current)."""
     try:
-        logger.info(f"Fetching standings for League {LEAGUE_ID}, Season {SEASON}")
+        season = season or current_season()
+        logger.info(f"Fetching standings for League {LEAGUE_ID}, Season {season}")
         
         data = api_get("/standings", {
             "league": LEAGUE_ID,
-            "season": SEASON
+            "season": season
         })
         
         if not data:
@@ -120,29 +296,46 @@ def get_standings():
             logger.error("Empty standings table")
             raise ValueError("No teams in standings")
         
-        rows = []
+        # Build one list per column so the DataFrame is created column-wise
+        ranks, teams, points, played = [], [], [], []
+        wins, draws, losses = [], [], []
+        goals_for, goals_against, goal_difference = [], [], []
+        columns = (
+            ranks, teams, points, played, wins, draws, losses,
+            goals_for, goals_against, goal_difference
+        )
         for t in table:
             try:
-                rows.append({
-                    "rank": t["rank"],
-                    "team": t["team"]["name"],
-                    "points": t["points"],
-                    "played": t["all"]["played"],
-                    "wins": t["all"]["win"],
-                    "draws": t["all"]["draw"],
-                    "losses": t["all"]["lose"],
-                    "goals_for": t["all"]["goals"]["for"],
-                    "goals_against": t["all"]["goals"]["against"],
-                    "goal_difference": t["goalsDiff"]
-                })
+                # Read every field first so a missing key never leaves the
+                # columns with different lengths
+                record = t["all"]
+                row = (
+                    t["rank"], t["team"]["name"], t["points"], record["played"],
+                    record["win"], record["draw"], record["lose"],
+                    record["goals"]["for"], record["goals"]["against"], t["goalsDiff"]
+                )
             except KeyError as e:
-                logger.error(f"Missing key in team data: {e}")
+                logger.error("Missing key in team data: %s", e)
                 continue
+            
+            for column, value in zip(columns, row):
+                column.append(value)
         
-        if not rows:
+        if not teams:
             raise ValueError("No valid team data parsed")
         
-        df = pd.DataFrame(rows)
+        df = pd.DataFrame({
+            "rank": np.asarray(ranks, dtype=np.int16),
+            "team": teams,
+            "points": np.asarray(points, dtype=np.int16),
+            "played": np.asarray(played, dtype=np.int16),
+            "wins": np.asarray(wins, dtype=np.int16),
+            "draws": np.asarray(draws, dtype=np.int16),
+            "losses": np.asarray(losses, dtype=np.int16),
+            "goals_for": np.asarray(goals_for, dtype=np.int16),
+            "goals_against": np.asarray(goals_against, dtype=np.int16),
+            "goal_difference": np.asarray(goal_difference, dtype=np.int16)
+        })
         logger.info(f"✓ Parsed {len(df)} teams from standings")
         return df
         
@@ -151,101 +344,70 @@ def get_standings():
         raise
 
 # =========================
-# 2. TOP SCORERS
+# TOP PLAYERS (SHARED)
 # =========================
-def get_top_scorers():
-    """Fetch and parse top scorers data."""
+def _parse_top(data, stat_key, column, label):
+    """Parse a top players payload on one `goals` stat into a DataFrame."""
+    # One pass over the payload; optional fields use .get and players
+    # with a null stat are filtered out. A missing name/team means the
+    # API shape changed and is raised to the caller.
+    records = [
+        (p["player"]["name"], stats["team"]["name"], value,
+         stats.get("games", {}).get("appearences") or 0)
+        for p in data
+        for stats in (p.get("statistics") or [])[:1]
+        for value in (stats.get("goals", {}).get(stat_key),)
+        if value is not None
+    ]
+    
+    skipped = len(data) - len(records)
+    if skipped:
+        logger.info("Skipped %d %s entries with missing statistics or %s", skipped, label, column)
+    
+    if not records:
+        raise ValueError(f"No valid {label} data parsed")
+    
+    players, teams, values, appearances = zip(*records)
+    return pd.DataFrame({
+        "player": list(players),
+        "team": list(teams),
+        column: np.asarray(values, dtype=np.int16),
+        "appearances": np.asarray(appearances, dtype=np.int16)
+    })
+
+def _get_top(endpoint, stat_key, column, label, season=None):
+    """Fetch and parse one of the top players endpoints."""
     try:
-        logger.info(f"Fetching top scorers for League {LEAGUE_ID}, Season {SEASON}")
+        season = season or current_season()
+        logger.info(f"Fetching {label} for League {LEAGUE_ID}, Season {season}")
         
-        data = api_get("/players/topscorers", {
+        data = api_get(endpoint, {
             "league": LEAGUE_ID,
-            "season": SEASON
+            "season": season
         })
         
         if not data:
-            logger.error("No top scorers data received from API")
-            raise ValueError("Failed to fetch top scorers data")
-        
-        rows = []
-        for p in data:
-            try:
-                stats = p["statistics"][0]
-                
-                # Skip players with null goals
-                if stats["goals"]["total"] is None:
-                    continue
-                
-                rows.append({
-                    "player": p["player"]["name"],
-                    "team": stats["team"]["name"],
-                    "goals": stats["goals"]["total"],
-                    "appearances": stats["games"]["appearences"] or 0
-                })
-            except (KeyError, IndexError) as e:
-                logger.warning(f"Skipping player due to missing data: {e}")
-                continue
+            logger.error(f"No {label} data received from API")
+            raise ValueError(f"Failed to fetch {label} data")
         
-        if not rows:
-            raise ValueError("No valid top scorers data parsed")
-        
-        df = pd.DataFrame(rows)
-        logger.info(f"✓ Parsed {len(df)} players from top scorers")
+        df = _parse_top(data, stat_key, column, label)
+        logger.info(f"✓ Parsed {len(df)} players from {label}")
         return df
         
     except Exception as e:
-        logger.error(f"Error fetching top scorers: {str(e)}")
+        logger.error(f"Error fetching {label}: {str(e)}")
         raise
 
 # =========================
-# 3. TOP ASSISTS
+# 2. TOP SCORERS
 # =========================
-def get_top_assists():
-    """Fetch and parse top assists data."""
-    try:
-        logger.info(f"Fetching top assists for League {LEAGUE_ID}, Season {SEASON}")
-        
-        data = api_get("/players/topassists", {
-            "league": LEAGUE_ID,
-            "season": SEASON
-        })
-        
-        if not data:
-            logger.error("No top assists data received from API")
-            raise ValueError("Failed to fetch top assists data")
-        
-        rows = []
-        for p in data:
-            try:
-                stats = p["statistics"][0]
-                
-                # Skip players with null assists
-                if stats["goals"]["assists"] is None:
-                    continue
-                
-                rows.append({
-                    "player": p["player"]["name"],
-                    "team": stats["team"]["name"],
-                    "assists": stats["goals"]["assists"],
-                    "appearances": stats["games"]["appearences"] or 0
-                })
-            except (KeyError, IndexError) as e:
-                logger.warning(f"Skipping player due to missing data: {e}")
-                continue
-        
-        if not rows:
-            raise ValueError("No valid top assists data parsed")
-        
-        df = pd.DataFrame(rows)
-        logger.info(f"✓ Parsed {len(df)} players from top assists")
-        return df
-        
-    except Exception as e:
-        logger.error(f"Error fetching top assists: {str(e)}")
-        raise
+def get_top_scorers(season=None):
+    """Fetch and parse top scorers data for a season (default: current)."""
+    return _get_top("/players/topscorers", "total", "goals", "top scorers", season)
 
-# Validate API key on module import
-try:
-    validate_api_key()
-except Exception as e:
-    logger.error(f"API configuration error: {str(e)}")
\ No newline at end of file
+# =========================
+# 3. TOP ASSISTS
+# =========================
+def get_top_assists(season=None):
+    """Fetch and parse top assists data for a season (default: current)."""
+    return _get_top("/players/topassists", "assists", "assists", "top assists", season)
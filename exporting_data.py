@@ -1,10 +1,15 @@
 import os
+import argparse
+import numpy as np
 import pandas as pd
 import urllib.parse
 from datetime import datetime, timezone
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
 from sqlalchemy import create_engine, event, text, types
 from catching_data import (
+    current_season,
     get_standings,
     get_top_scorers,
     get_top_assists
@@ -33,6 +38,39 @@ SQL_PASSWORD = os.getenv("SQL_PASSWORD")
 SQL_DRIVER = os.getenv("SQL_DRIVER", "ODBC Driver 17 for SQL Server")
 SQL_SCHEMA = os.getenv("SQL_SCHEMA", "dbo")
 
+# =========================
+# TABLE SCHEMAS
+# =========================
+_STANDINGS_DTYPE = {
+    "rank": types.SmallInteger(),
+    "team": types.Unicode(64),
+    "points": types.SmallInteger(),
+    "played": types.SmallInteger(),
+    "wins": types.SmallInteger(),
+    "draws": types.SmallInteger(),
+    "losses": types.SmallInteger(),
+    "goals_for": types.SmallInteger(),
+    "goals_against": types.SmallInteger(),
+    "goal_difference": types.SmallInteger(),
+    "exported_at": types.DateTime()
+}
+
+_TOP_SCORERS_DTYPE = {
+    "player": types.Unicode(128),
+    "team": types.Unicode(64),
+    "goals": types.SmallInteger(),
+    "appearances": types.SmallInteger(),
+    "exported_at": types.DateTime()
+}
+
+_TOP_ASSISTS_DTYPE = {
+    "player": types.Unicode(128),
+    "team": types.Unicode(64),
+    "assists": types.SmallInteger(),
+    "appearances": types.SmallInteger(),
+    "exported_at": types.DateTime()
+}
+
 # =========================
 # VALIDATION FUNCTIONS
 # =========================
@@ -55,20 +93,33 @@ def validate_standings(df: pd.DataFrame) -> bool:
             logger.error("Duplicate teams found in standings")
             return False
         
+        # The int16 cast below would silently turn NaN into 0 and truncate
+        # fractions, so reject anything that is not a clean integer column
+        count_cols = ['wins', 'draws', 'losses', 'points', 'played']
+        for col in count_cols:
+            if not pd.api.types.is_integer_dtype(df[col]) or df[col].isna().any():
+                logger.error(f"Column {col} must contain integers without missing values")
+                return False
+        
+        # Work on raw int16 arrays to skip index alignment in the checks below
+        w = df['wins'].to_numpy(np.int16)
+        d = df['draws'].to_numpy(np.int16)
+        losses = df['losses'].to_numpy(np.int16)
+        p = df['points'].to_numpy(np.int16)
+        pl = df['played'].to_numpy(np.int16)
+        
         # Validate points are non-negative
-        if (df['points'] < 0).any():
+        if (p < 0).any():
             logger.error("Negative points found")
             return False
         
         # Validate math: points should equal (wins * 3) + draws
-        calculated_points = (df['wins'] * 3) + df['draws']
-        if not (df['points'] == calculated_points).all():
+        if not np.array_equal(p, w * 3 + d):
             logger.error("Points calculation mismatch")
             return False
         
         # Validate games played = wins + draws + losses
-        total_games = df['wins'] + df['draws'] + df['losses']
-        if not (df['played'] == total_games).all():
+        if not np.array_equal(pl, w + d + losses):
             logger.error("Games played calculation mismatch")
             return False
         
@@ -160,8 +211,14 @@ def create_db_engine():
             "TrustServerCertificate=yes;"
         )
         
+        # Keep a small pool of health-checked connections so a long-running
+        # process reuses its login between pipeline runs
         engine = create_engine(
-            f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(conn_str)}"
+            f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(conn_str)}",
+            pool_pre_ping=True,
+            pool_size=2,
+            max_overflow=0,
+            pool_recycle=1800
         )
         
         @event.listens_for(engine, "before_cursor_execute")
@@ -183,15 +240,86 @@ def create_db_engine():
 # =========================
 # EXPORT FUNCTION
 # =========================
-def overwrite(df: pd.DataFrame, table: str, engine):
-    """Export dataframe to SQL Server with validation and error handling."""
+def _sql_type(dtype) -> str:
+    """Map a pandas dtype to the SQL Server column type used for it."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BIT"
+    if pd.api.types.is_integer_dtype(dtype):
+        return {1: "SMALLINT", 2: "SMALLINT", 4: "INT"}.get(dtype.itemsize, "BIGINT")
+    if pd.api.types.is_float_dtype(dtype):
+        return "FLOAT"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "DATETIME"
+    return "NVARCHAR(255)"
+
+def _table_columns(df: pd.DataFrame, dtype=None, dialect=None) -> list:
+    """List (column, SQL type) pairs, preferring explicit SQLAlchemy types."""
+    dtype = dtype or {}
+    columns = []
+    for col, col_dtype in df.dtypes.items():
+        if col in dtype:
+            sql_type = dtype[col].compile(dialect=dialect)
+        else:
+            sql_type = _sql_type(col_dtype)
+        columns.append((col, sql_type.upper()))
+    return columns
+
+def _create_table_sql(df: pd.DataFrame, table: str, dtype=None, dialect=None) -> str:
+    """Build a CREATE TABLE statement for the dataframe."""
+    columns = ", ".join(f"[{col}] {sql_type}" for col, sql_type in _table_columns(df, dtype, dialect))
+    return f"CREATE TABLE {SQL_SCHEMA}.{table} ({columns});"
+
+def _existing_columns(conn, table: str) -> list:
+    """List (column, SQL type) pairs of an existing table, empty if missing."""
+    rows = conn.execute(
+        text(
+            "SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH "
+            "FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE TABLE_SCHEMA = :schema AND TABLE_NAME = :table "
+            "ORDER BY ORDINAL_POSITION"
+        ),
+        {"schema": SQL_SCHEMA, "table": table}
+    ).fetchall()
+    
+    columns = []
+    for name, data_type, length in rows:
+        sql_type = data_type.upper()
+        if length is not None:
+            sql_type += "(MAX)" if length == -1 else f"({length})"
+        columns.append((name, sql_type))
+    return columns
+
+def _insert_sql(df: pd.DataFrame, table: str) -> str:
+    """Build a positional INSERT statement for every dataframe column."""
+    columns = ", ".join(f"[{col}]" for col in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    return f"INSERT INTO {SQL_SCHEMA}.{table} ({columns}) VALUES ({placeholders})"
+
+def _to_rows(df: pd.DataFrame) -> list:
+    """Convert the dataframe into a list of tuples of native Python values."""
+    columns = []
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            columns.append(df[col].dt.to_pydatetime().tolist())
+        else:
+            columns.append(df[col].tolist())
+    return list(zip(*columns))
+
+def overwrite(df: pd.DataFrame, table: str, conn, dtype=None):
+    """Export dataframe to SQL Server with validation and error handling.
+    
+    Runs inside a savepoint on the caller's connection, so a failed table
+    is rolled back without discarding tables already written in the same
+    transaction.
+    """
+    # The timestamp column is set on the caller's frame for the duration of
+    # the write and restored afterwards, instead of copying the whole frame
+    original_exported_at = df["exported_at"] if "exported_at" in df.columns else None
     try:
         # Add timestamp
-        if "exported_at" not in df.columns:
-            df = df.copy()
-            df["exported_at"] = datetime.now(timezone.utc)
+        if original_exported_at is None:
+            df["exported_at"] = datetime.now(timezone.utc).replace(tzinfo=None)
         else:
-            df = df.copy()
             try:
                 if pd.api.types.is_datetime64tz_dtype(df["exported_at"]):
                     df["exported_at"] = df["exported_at"].dt.tz_convert("UTC").dt.tz_localize(None)
@@ -200,22 +328,26 @@ def overwrite(df: pd.DataFrame, table: str, engine):
             except Exception:
                 df["exported_at"] = pd.to_datetime(df["exported_at"])
         
-        # Drop existing table
-        drop_sql = f"IF OBJECT_ID('{SQL_SCHEMA}.{table}', 'U') IS NOT NULL DROP TABLE {SQL_SCHEMA}.{table};"
-        
-        with engine.begin() as conn:
-            conn.execute(text(drop_sql))
+        expected_columns = _table_columns(df, dtype, conn.dialect)
+        
+        with conn.begin_nested():
+            # Empty the table in place so indexes, permissions and cached
+            # query plans survive between runs. A table whose columns no
+            # longer match (e.g. one created by an older version) is rebuilt.
+            existing_columns = _existing_columns(conn, table)
+            if existing_columns and existing_columns != expected_columns:
+                logger.warning(f"Schema of {SQL_SCHEMA}.{table} changed, recreating table")
+                conn.execute(text(f"DROP TABLE {SQL_SCHEMA}.{table};"))
+                existing_columns = []
+            
+            if existing_columns:
+                conn.execute(text(f"TRUNCATE TABLE {SQL_SCHEMA}.{table};"))
+            else:
+                conn.execute(text(_create_table_sql(df, table, dtype, conn.dialect)))
             
-            # Write DataFrame to SQL
-            df.to_sql(
-                name=table,
-                con=conn,
-                schema=SQL_SCHEMA,
-                if_exists="replace",
-                index=False,
-                method="multi",
-                dtype={"exported_at": types.DateTime()}
-            )
+            # Write DataFrame to SQL as one executemany; the engine's
+            # before_cursor_execute listener turns on fast_executemany
+            conn.exec_driver_sql(_insert_sql(df, table), _to_rows(df))
         
         logger.info(f"✓ Successfully wrote {len(df)} rows to {SQL_SCHEMA}.{table}")
         return True
@@ -223,11 +355,18 @@ def overwrite(df: pd.DataFrame, table: str, engine):
     except Exception as e:
         logger.error(f"Failed to write table {table}: {str(e)}")
         return False
+    
+    finally:
+        if original_exported_at is None:
+            if "exported_at" in df.columns:
+                del df["exported_at"]
+        else:
+            df["exported_at"] = original_exported_at
 
 # =========================
 # MAIN PIPELINE
 # =========================
-def run_pipeline():
+def run_pipeline(engine=None):
     """Main pipeline execution with comprehensive error handling."""
     logger.info("="*50)
     logger.info("Starting EPL Data Pipeline")
@@ -236,59 +375,70 @@ def run_pipeline():
     pipeline_success = True
     
     try:
-        # Create database engine
-        engine = create_db_engine()
-        
-        # 1. Process Standings
-        logger.info("Fetching EPL standings...")
-        try:
-            standings_df = get_standings()
-            if validate_standings(standings_df):
-                if overwrite(standings_df, "epl_standings", engine):
-                    logger.info("✓ Standings processed successfully")
+        # Create database engine unless a warm one was passed in
+        if engine is None:
+            engine = create_db_engine()
+        
+        # Read the season once so all tables describe the same season, even
+        # if the run crosses the August rollover
+        season = current_season()
+        
+        # Fetch all endpoints concurrently; they are independent and I/O-bound
+        logger.info("Fetching EPL standings, top scorers and top assists...")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            standings_future = executor.submit(get_standings, season)
+            scorers_future = executor.submit(get_top_scorers, season)
+            assists_future = executor.submit(get_top_assists, season)
+        
+        # Write all tables over one connection and transaction
+        with engine.begin() as conn:
+            # 1. Process Standings
+            try:
+                standings_df = standings_future.result()
+                if validate_standings(standings_df):
+                    if overwrite(standings_df, "epl_standings", conn, dtype=_STANDINGS_DTYPE):
+                        logger.info("✓ Standings processed successfully")
+                    else:
+                        logger.error("✗ Failed to write standings")
+                        pipeline_success = False
                 else:
-                    logger.error("✗ Failed to write standings")
+                    logger.error("✗ Standings validation failed")
                     pipeline_success = False
-            else:
-                logger.error("✗ Standings validation failed")
+            except Exception as e:
+                logger.error(f"✗ Error processing standings: {str(e)}")
                 pipeline_success = False
-        except Exception as e:
-            logger.error(f"✗ Error processing standings: {str(e)}")
-            pipeline_success = False
-        
-        # 2. Process Top Scorers
-        logger.info("Fetching top scorers...")
-        try:
-            scorers_df = get_top_scorers()
-            if validate_top_scorers(scorers_df):
-                if overwrite(scorers_df, "epl_top_scorers", engine):
-                    logger.info("✓ Top scorers processed successfully")
+            
+            # 2. Process Top Scorers
+            try:
+                scorers_df = scorers_future.result()
+                if validate_top_scorers(scorers_df):
+                    if overwrite(scorers_df, "epl_top_scorers", conn, dtype=_TOP_SCORERS_DTYPE):
+                        logger.info("✓ Top scorers processed successfully")
+                    else:
+                        logger.error("✗ Failed to write top scorers")
+                        pipeline_success = False
                 else:
-                    logger.error("✗ Failed to write top scorers")
+                    logger.error("✗ Top scorers validation failed")
                     pipeline_success = False
-            else:
-                logger.error("✗ Top scorers validation failed")
+            except Exception as e:
+                logger.error(f"✗ Error processing top scorers: {str(e)}")
                 pipeline_success = False
-        except Exception as e:
-            logger.error(f"✗ Error processing top scorers: {str(e)}")
-            pipeline_success = False
-        
-        # 3. Process Top Assists
-        logger.info("Fetching top assists...")
-        try:
-            assists_df = get_top_assists()
-            if validate_top_assists(assists_df):
-                if overwrite(assists_df, "epl_top_assists", engine):
-                    logger.info("✓ Top assists processed successfully")
+            
+            # 3. Process Top Assists
+            try:
+                assists_df = assists_future.result()
+                if validate_top_assists(assists_df):
+                    if overwrite(assists_df, "epl_top_assists", conn, dtype=_TOP_ASSISTS_DTYPE):
+                        logger.info("✓ Top assists processed successfully")
+                    else:
+                        logger.error("✗ Failed to write top assists")
+                        pipeline_success = False
                 else:
-                    logger.error("✗ Failed to write top assists")
+                    logger.error("✗ Top assists validation failed")
                     pipeline_success = False
-            else:
-                logger.error("✗ Top assists validation failed")
+            except Exception as e:
+                logger.error(f"✗ Error processing top assists: {str(e)}")
                 pipeline_success = False
-        except Exception as e:
-            logger.error(f"✗ Error processing top assists: {str(e)}")
-            pipeline_success = False
         
         # Summary
         logger.info("="*50)
@@ -305,9 +455,45 @@ def run_pipeline():
         logger.info("="*50)
         return False
 
+# =========================
+# DAEMON MODE
+# =========================
+def run_daemon(interval: int) -> bool:
+    """Run the pipeline forever, reusing one warm engine between runs.
+    
+    Only returns (False) if the database engine cannot be created.
+    """
+    try:
+        engine = create_db_engine()
+    except Exception as e:
+        logger.error(f"✗ DAEMON FAILED TO START: {str(e)}")
+        return False
+    
+    while True:
+        run_pipeline(engine)
+        logger.info(f"Next pipeline run in {interval} seconds")
+        sleep(interval)
+
+def positive_seconds(value: str) -> int:
+    """argparse type for a whole number of seconds, at least 1."""
+    seconds = int(value)
+    if seconds < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1 second, got {seconds}")
+    return seconds
+
 # =========================
 # ENTRY POINT
 # =========================
 if __name__ == "__main__":
-    success = run_pipeline()
-    exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="EPL data pipeline")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and repeat the pipeline every --interval seconds")
+    parser.add_argument("--interval", type=positive_seconds, default=86400,
+                        help="seconds between runs in daemon mode (default: 86400)")
+    args = parser.parse_args()
+    
+    if args.daemon:
+        success = run_daemon(args.interval)
+    else:
+        success = run_pipeline()
+    exit(0 if success else 1)
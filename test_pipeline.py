@@ -3,11 +3,21 @@ Unit tests for EPL Data Pipeline
 Run with: pytest test_pipeline.py -v
 """
 
+import argparse
+import io
 import pytest
 import pandas as pd
-from datetime import datetime
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
 import sys
 import os
+from sqlalchemy.dialects import mssql
+import requests
+import requests_cache
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
 
 # Add parent directory to path to import modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -15,7 +25,24 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from exporting_data import (
     validate_standings,
     validate_top_scorers,
-    validate_top_assists
+    validate_top_assists,
+    overwrite,
+    _STANDINGS_DTYPE,
+    _sql_type,
+    _create_table_sql,
+    _insert_sql,
+    _to_rows
+)
+import exporting_data
+import catching_data
+from catching_data import (
+    TokenBucket,
+    current_season,
+    get_standings,
+    _parse_top,
+    _retry_after_seconds,
+    _pace_rate_limit,
+    _cached_fallback
 )
 
 # =========================
@@ -156,6 +183,18 @@ class TestStandingsValidation:
         """Test that empty dataframe fails validation."""
         df = pd.DataFrame()
         assert validate_standings(df) == False
+    
+    def test_nan_row(self, valid_standings_df):
+        """Test that NaN counts fail validation instead of being cast to 0."""
+        df = valid_standings_df.astype({'points': float, 'wins': float, 'draws': float})
+        df.loc[2, ['points', 'wins', 'draws']] = float('nan')
+        assert validate_standings(df) == False
+    
+    def test_fractional_counts(self, valid_standings_df):
+        """Test that non-integer counts fail validation instead of being truncated."""
+        df = valid_standings_df.astype({'points': float})
+        df.loc[0, 'points'] = 84.5
+        assert validate_standings(df) == False
 
 # =========================
 # TOP SCORERS VALIDATION TESTS
@@ -262,6 +301,554 @@ class TestDataFrameStructure:
         assert valid_assists_df['player'].dtype == 'object'
         assert valid_assists_df['assists'].dtype in ['int64', 'int32']
 
+# =========================
+# EXPORT TESTS
+# =========================
+
+class TestWriteHelpers:
+    """Test suite for the SQL statement and row builders."""
+    
+    def test_sql_type_mapping(self):
+        """Test that dtypes map to the expected SQL Server types."""
+        assert _sql_type(pd.Series([1], dtype='int16').dtype) == 'SMALLINT'
+        assert _sql_type(pd.Series([1], dtype='int32').dtype) == 'INT'
+        assert _sql_type(pd.Series([1], dtype='int64').dtype) == 'BIGINT'
+        assert _sql_type(pd.Series([True]).dtype) == 'BIT'
+        assert _sql_type(pd.Series([1.5]).dtype) == 'FLOAT'
+        assert _sql_type(pd.Series(pd.to_datetime(['2025-01-01'])).dtype) == 'DATETIME'
+        assert _sql_type(pd.Series(['Arsenal']).dtype) == 'NVARCHAR(255)'
+    
+    def test_create_table_sql_typed(self, valid_standings_df):
+        """Test that the explicit standings schema reaches the DDL."""
+        df = valid_standings_df.assign(exported_at=pd.Timestamp('2025-05-25'))
+        sql = _create_table_sql(df, 'epl_standings', _STANDINGS_DTYPE, mssql.dialect())
+        assert sql.startswith('CREATE TABLE dbo.epl_standings (')
+        assert '[rank] SMALLINT' in sql
+        assert '[points] SMALLINT' in sql
+        assert '[team] NVARCHAR(64)' in sql
+        assert '[exported_at] DATETIME' in sql
+        assert 'BIGINT' not in sql
+    
+    def test_insert_sql_placeholders(self, valid_scorers_df):
+        """Test that the INSERT lists every column with one placeholder each."""
+        sql = _insert_sql(valid_scorers_df, 'epl_top_scorers')
+        columns, values = sql.split(' VALUES ')
+        assert columns.endswith('([player], [team], [goals], [appearances])')
+        assert values == '(?, ?, ?, ?)'
+    
+    def test_to_rows_native_types(self):
+        """Test that rows hold plain Python values for fast_executemany."""
+        df = pd.DataFrame({
+            'team': ['Liverpool', 'Arsenal'],
+            'points': pd.Series([84, 74], dtype='int16'),
+            'exported_at': pd.to_datetime(['2025-05-25 12:00', '2025-05-25 12:00'])
+        })
+        rows = _to_rows(df)
+        assert rows == [
+            ('Liverpool', 84, datetime(2025, 5, 25, 12, 0)),
+            ('Arsenal', 74, datetime(2025, 5, 25, 12, 0))
+        ]
+        for team, points, exported_at in rows:
+            assert type(team) is str
+            assert type(points) is int
+            assert type(exported_at) is datetime
+
+class StubConnection:
+    """Stand-in for a SQLAlchemy connection that records statements."""
+    
+    def __init__(self, fail=False, existing_columns=None):
+        self.fail = fail
+        self.existing_columns = existing_columns or []
+        self.dialect = mssql.dialect()
+        self.statements = []
+        self.rows = None
+    
+    @contextmanager
+    def begin_nested(self):
+        if self.fail:
+            raise RuntimeError("savepoint failed")
+        yield
+    
+    def execute(self, statement, parameters=None):
+        self.statements.append(str(statement))
+        return SimpleNamespace(fetchall=lambda: self.existing_columns)
+    
+    def exec_driver_sql(self, statement, parameters=None):
+        self.statements.append(statement)
+        self.rows = parameters
+
+class TestOverwrite:
+    """Test suite for the SQL export leaving the caller's frame untouched."""
+    
+    @pytest.mark.parametrize('fail', [False, True])
+    def test_added_timestamp_removed(self, valid_standings_df, fail):
+        """Test that a timestamp added for the write is removed afterwards."""
+        columns = list(valid_standings_df.columns)
+        assert overwrite(valid_standings_df, 'epl_standings', StubConnection(fail)) is not fail
+        assert list(valid_standings_df.columns) == columns
+    
+    @pytest.mark.parametrize('fail', [False, True])
+    def test_existing_timestamp_restored(self, valid_standings_df, fail):
+        """Test that a caller-supplied timestamp is restored unchanged."""
+        df = valid_standings_df
+        df['exported_at'] = pd.to_datetime(['2025-05-25T12:00:00+01:00'] * len(df))
+        columns = list(df.columns)
+        original = df['exported_at'].copy()
+        
+        assert overwrite(df, 'epl_standings', StubConnection(fail)) is not fail
+        assert list(df.columns) == columns
+        pd.testing.assert_series_equal(df['exported_at'], original)
+    
+    @staticmethod
+    def issued(conn, keyword):
+        """Return whether a statement starting with keyword was executed."""
+        return any(statement.startswith(keyword) for statement in conn.statements)
+    
+    def test_creates_missing_table(self, valid_standings_df):
+        """Test that a missing table is created and not truncated."""
+        conn = StubConnection()
+        assert overwrite(valid_standings_df, 'epl_standings', conn)
+        assert self.issued(conn, 'CREATE TABLE')
+        assert not self.issued(conn, 'TRUNCATE')
+        assert not self.issued(conn, 'DROP')
+    
+    def test_truncates_matching_table(self, valid_standings_df):
+        """Test that a table with the expected schema is only truncated."""
+        existing = [(col, 'bigint', None) for col in valid_standings_df.columns]
+        existing[1] = ('team', 'nvarchar', 255)
+        existing.append(('exported_at', 'datetime', None))
+        
+        conn = StubConnection(existing_columns=existing)
+        assert overwrite(valid_standings_df, 'epl_standings', conn)
+        assert self.issued(conn, 'TRUNCATE TABLE')
+        assert not self.issued(conn, 'CREATE TABLE')
+        assert not self.issued(conn, 'DROP')
+    
+    def test_recreates_drifted_table(self, valid_standings_df):
+        """Test that a table left by the old to_sql export is rebuilt."""
+        existing = [(col, 'bigint', None) for col in valid_standings_df.columns]
+        existing[1] = ('team', 'nvarchar', -1)
+        existing.append(('exported_at', 'datetime', None))
+        
+        conn = StubConnection(existing_columns=existing)
+        assert overwrite(valid_standings_df, 'epl_standings', conn, dtype=_STANDINGS_DTYPE)
+        assert self.issued(conn, 'DROP TABLE')
+        assert self.issued(conn, 'CREATE TABLE')
+        assert not self.issued(conn, 'TRUNCATE')
+    
+    def test_writes_rows_with_timestamp(self, valid_standings_df):
+        """Test that the written rows include the export timestamp."""
+        conn = StubConnection()
+        overwrite(valid_standings_df, 'epl_standings', conn)
+        assert len(conn.rows) == len(valid_standings_df)
+        assert isinstance(conn.rows[0][-1], datetime)
+
+# =========================
+# PIPELINE TESTS
+# =========================
+
+class TestRunPipeline:
+    """Test suite for the end-to-end pipeline wiring."""
+    
+    def test_one_season_for_all_fetches(self, monkeypatch, valid_standings_df,
+                                        valid_scorers_df, valid_assists_df):
+        """Test that all three fetchers receive the same season."""
+        # A clock that would move on with every read
+        seasons = iter([2024, 2025, 2026])
+        monkeypatch.setattr(exporting_data, 'current_season', lambda: next(seasons))
+        
+        received = {}
+        def fetcher(name, df):
+            def fetch(season):
+                received[name] = season
+                return df
+            return fetch
+        monkeypatch.setattr(exporting_data, 'get_standings', fetcher('standings', valid_standings_df))
+        monkeypatch.setattr(exporting_data, 'get_top_scorers', fetcher('scorers', valid_scorers_df))
+        monkeypatch.setattr(exporting_data, 'get_top_assists', fetcher('assists', valid_assists_df))
+        
+        engine = SimpleNamespace(begin=lambda: nullcontext(StubConnection()))
+        assert exporting_data.run_pipeline(engine) is True
+        assert received == {'standings': 2024, 'scorers': 2024, 'assists': 2024}
+    
+    def test_season_forwarded_to_api(self, monkeypatch, top_players_payload):
+        """Test that an explicit season reaches the API query parameters."""
+        calls = []
+        def fake_api_get(endpoint, params):
+            calls.append(params)
+            return top_players_payload
+        monkeypatch.setattr(catching_data, 'api_get', fake_api_get)
+        
+        catching_data.get_top_scorers(2023)
+        assert calls == [{'league': catching_data.LEAGUE_ID, 'season': 2023}]
+
+# =========================
+# DAEMON MODE TESTS
+# =========================
+
+class TestDaemon:
+    """Test suite for the daemon entry point."""
+    
+    def test_interval_accepts_positive(self):
+        """Test that a positive interval is accepted."""
+        assert exporting_data.positive_seconds('60') == 60
+    
+    @pytest.mark.parametrize('value', ['0', '-5'])
+    def test_interval_rejects_below_one(self, value):
+        """Test that zero and negative intervals are rejected."""
+        with pytest.raises(argparse.ArgumentTypeError):
+            exporting_data.positive_seconds(value)
+    
+    def test_engine_failure_returns_false(self, monkeypatch):
+        """Test that a failed engine start is reported instead of raised."""
+        def fail():
+            raise RuntimeError("login failed")
+        monkeypatch.setattr(exporting_data, 'create_db_engine', fail)
+        assert exporting_data.run_daemon(60) is False
+
+# =========================
+# STANDINGS PARSER TESTS
+# =========================
+
+def standings_team(rank, team, wins, draws, losses, goals_for, goals_against):
+    """Build one team entry as returned by the standings endpoint."""
+    return {
+        'rank': rank,
+        'team': {'name': team},
+        'points': wins * 3 + draws,
+        'goalsDiff': goals_for - goals_against,
+        'all': {
+            'played': wins + draws + losses,
+            'win': wins,
+            'draw': draws,
+            'lose': losses,
+            'goals': {'for': goals_for, 'against': goals_against}
+        }
+    }
+
+class TestGetStandings:
+    """Test suite for the column-wise standings parser."""
+    
+    def test_missing_key_skips_only_that_row(self, monkeypatch):
+        """Test that a team missing a key is dropped without shifting columns."""
+        broken = standings_team(2, 'Arsenal', 20, 14, 4, 91, 56)
+        del broken['goalsDiff']
+        table = [
+            standings_team(1, 'Liverpool', 25, 9, 4, 86, 41),
+            broken,
+            standings_team(3, 'Man City', 21, 8, 9, 96, 68)
+        ]
+        payload = [{'league': {'standings': [table]}}]
+        monkeypatch.setattr(catching_data, 'api_get', lambda endpoint, params: payload)
+        
+        df = get_standings()
+        
+        assert df['team'].tolist() == ['Liverpool', 'Man City']
+        assert df['rank'].tolist() == [1, 3]
+        assert df['points'].tolist() == [84, 71]
+        assert df['played'].tolist() == [38, 38]
+        assert df['wins'].tolist() == [25, 21]
+        assert df['draws'].tolist() == [9, 8]
+        assert df['losses'].tolist() == [4, 9]
+        assert df['goals_for'].tolist() == [86, 96]
+        assert df['goals_against'].tolist() == [41, 68]
+        assert df['goal_difference'].tolist() == [45, 28]
+    
+    def test_numeric_columns_are_int16(self, monkeypatch):
+        """Test that every numeric standings column is built as int16."""
+        table = [standings_team(1, 'Liverpool', 25, 9, 4, 86, 41)]
+        payload = [{'league': {'standings': [table]}}]
+        monkeypatch.setattr(catching_data, 'api_get', lambda endpoint, params: payload)
+        
+        df = get_standings()
+        
+        assert df['team'].dtype == 'object'
+        for col in df.columns.drop('team'):
+            assert df[col].dtype == 'int16', col
+
+# =========================
+# TOP PLAYERS PARSER TESTS
+# =========================
+
+@pytest.fixture
+def top_players_payload():
+    """Create a raw top players API payload for testing."""
+    return [
+        {
+            'player': {'name': 'Mohamed Salah'},
+            'statistics': [{
+                'team': {'name': 'Liverpool'},
+                'goals': {'total': 29, 'assists': 18},
+                'games': {'appearences': 38}
+            }]
+        },
+        {
+            'player': {'name': 'Erling Haaland'},
+            'statistics': [{
+                'team': {'name': 'Man City'},
+                'goals': {'total': 22, 'assists': None},
+                'games': {'appearences': None}
+            }]
+        },
+        {
+            'player': {'name': 'No Stats'},
+            'statistics': []
+        }
+    ]
+
+class TestParseTop:
+    """Test suite for the shared top players parser."""
+    
+    def test_parses_goals(self, top_players_payload):
+        """Test that goals are parsed and missing appearances default to 0."""
+        df = _parse_top(top_players_payload, 'total', 'goals', 'top scorers')
+        assert list(df.columns) == ['player', 'team', 'goals', 'appearances']
+        assert df['goals'].tolist() == [29, 22]
+        assert df['appearances'].tolist() == [38, 0]
+    
+    def test_skips_null_stat(self, top_players_payload):
+        """Test that players with a null stat are skipped."""
+        df = _parse_top(top_players_payload, 'assists', 'assists', 'top assists')
+        assert df['player'].tolist() == ['Mohamed Salah']
+    
+    def test_no_valid_rows(self):
+        """Test that a payload without usable rows raises."""
+        with pytest.raises(ValueError):
+            _parse_top([], 'total', 'goals', 'top scorers')
+
+# =========================
+# RESPONSE CACHE TESTS
+# =========================
+
+STANDINGS_URL = "https://v3.football.api-sports.io/standings?league=39&season=2024"
+GOOD_BODY = b'{"get":"standings","errors":[],"results":1,"response":[{"team":"Liverpool"}]}'
+ERROR_BODY = (
+    b'{"get":"standings","errors":{"requests":"You have reached the request limit for the day"},'
+    b'"results":0,"response":[]}'
+)
+
+class FakeAdapter(BaseAdapter):
+    """Transport adapter that answers every request with a fixed body."""
+    
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+    
+    def send(self, request, **kwargs):
+        raw = HTTPResponse(
+            body=io.BytesIO(self.body),
+            status=200,
+            headers={'Content-Type': 'application/json'},
+            preload_content=False
+        )
+        return HTTPAdapter().build_response(request, raw)
+    
+    def close(self):
+        pass
+
+class TestIsCacheable:
+    """Test suite for the response cache filter."""
+    
+    @staticmethod
+    def response(body, status_code=200):
+        """Create a minimal response stub."""
+        return SimpleNamespace(status_code=status_code, content=body)
+    
+    def test_compact_body(self):
+        """Test that a compact body without errors is cached."""
+        assert catching_data._is_cacheable(self.response(GOOD_BODY))
+    
+    def test_spaced_body(self):
+        """Test that a pretty-printed body without errors is cached."""
+        body = b'{\n  "get": "standings",\n  "errors": [ ],\n  "response": []\n}'
+        assert catching_data._is_cacheable(self.response(body))
+    
+    def test_error_body(self):
+        """Test that a body reporting errors is not cached."""
+        assert not catching_data._is_cacheable(self.response(ERROR_BODY))
+        assert not catching_data._is_cacheable(self.response(b'{"errors": ["Invalid season"]}'))
+    
+    def test_error_status(self):
+        """Test that a non-200 response is not cached."""
+        assert not catching_data._is_cacheable(self.response(GOOD_BODY, status_code=500))
+
+class TestCachedFallback:
+    """Test suite for serving the last good body when the API refuses."""
+    
+    @pytest.fixture
+    def adapter(self, monkeypatch):
+        """Install an in-memory cached session backed by a fake adapter."""
+        adapter = FakeAdapter(GOOD_BODY)
+        session = requests_cache.CachedSession(
+            backend='memory',
+            allowable_codes=(200,),
+            filter_fn=catching_data._is_cacheable
+        )
+        session.mount('https://', adapter)
+        monkeypatch.setattr(catching_data, '_SESSION', session)
+        return adapter
+    
+    def test_serves_previous_body(self, adapter):
+        """Test that a 200 with errors returns the previously cached data."""
+        catching_data._SESSION.get(STANDINGS_URL)
+        adapter.body = ERROR_BODY
+        refused = catching_data._SESSION.get(STANDINGS_URL, force_refresh=True)
+        
+        assert refused.json()['errors']
+        assert _cached_fallback(refused) == [{'team': 'Liverpool'}]
+    
+    def test_nothing_cached(self, adapter):
+        """Test that the fallback returns None when nothing was cached."""
+        adapter.body = ERROR_BODY
+        refused = catching_data._SESSION.get(STANDINGS_URL)
+        assert _cached_fallback(refused) is None
+    
+    def test_error_body_not_stored(self, adapter):
+        """Test that a body reporting errors is never written to the cache."""
+        adapter.body = ERROR_BODY
+        refused = catching_data._SESSION.get(STANDINGS_URL)
+        cache = catching_data._SESSION.cache
+        assert cache.get_response(cache.create_key(refused.request)) is None
+
+# =========================
+# IMPORT SIDE EFFECT TESTS
+# =========================
+
+def test_import_builds_no_session():
+    """Test that importing catching_data does not create the cached session."""
+    assert catching_data._SESSION is None
+
+# =========================
+# SEASON DETECTION TESTS
+# =========================
+
+class TestCurrentSeason:
+    """Test suite for season detection."""
+    
+    def test_before_august_is_previous_season(self):
+        """Test that January to July belong to the season that started last year."""
+        assert current_season(datetime(2025, 7, 31)) == 2024
+    
+    def test_from_august_is_new_season(self):
+        """Test that the season rolls over on 1 August."""
+        assert current_season(datetime(2025, 8, 1)) == 2025
+
+# =========================
+# RATE LIMITER TESTS
+# =========================
+
+class TestTokenBucket:
+    """Test suite for the client-side API rate limiter."""
+    
+    @pytest.fixture
+    def fake_clock(self, monkeypatch):
+        """Replace the limiter's clock and sleep with a controllable fake."""
+        clock = {'now': 0.0, 'slept': []}
+        
+        def fake_sleep(seconds):
+            clock['slept'].append(seconds)
+            clock['now'] += seconds
+        
+        monkeypatch.setattr(catching_data, 'monotonic', lambda: clock['now'])
+        monkeypatch.setattr(catching_data, 'sleep', fake_sleep)
+        return clock
+    
+    def test_burst_within_capacity(self, fake_clock):
+        """Test that calls up to capacity do not wait."""
+        bucket = TokenBucket(capacity=3, refill_per_sec=1.0)
+        for _ in range(3):
+            bucket.acquire()
+        assert fake_clock['slept'] == []
+    
+    def test_waits_when_empty(self, fake_clock):
+        """Test that an empty bucket waits for one token to refill."""
+        bucket = TokenBucket(capacity=2, refill_per_sec=0.5)
+        for _ in range(3):
+            bucket.acquire()
+        assert fake_clock['slept'] == [pytest.approx(2.0)]
+
+class TestRetryAfter:
+    """Test suite for Retry-After header parsing."""
+    
+    @staticmethod
+    def response(headers):
+        """Create a minimal response stub carrying only headers."""
+        return SimpleNamespace(headers=headers)
+    
+    def test_delta_seconds(self):
+        """Test that a delta-seconds value is used as is."""
+        assert _retry_after_seconds(self.response({'Retry-After': '7'})) == 7
+    
+    def test_http_date(self):
+        """Test that an HTTP-date is converted to seconds from now."""
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        headers = {'Retry-After': format_datetime(retry_at, usegmt=True)}
+        assert 25 <= _retry_after_seconds(self.response(headers)) <= 30
+    
+    def test_http_date_in_past(self):
+        """Test that an HTTP-date in the past means no wait."""
+        headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        assert _retry_after_seconds(self.response(headers)) == 0
+    
+    def test_garbage_falls_back(self):
+        """Test that an unparseable value falls back to the default."""
+        headers = {'Retry-After': 'soon'}
+        assert _retry_after_seconds(self.response(headers)) == catching_data.DEFAULT_RETRY_AFTER
+    
+    def test_missing_falls_back(self):
+        """Test that a missing header falls back to the default."""
+        assert _retry_after_seconds(self.response({})) == catching_data.DEFAULT_RETRY_AFTER
+
+class TestPaceRateLimit:
+    """Test suite for pacing on the API's rate limit headers."""
+    
+    @pytest.fixture
+    def slept(self, monkeypatch):
+        """Record sleeps instead of waiting, without jitter."""
+        calls = []
+        monkeypatch.setattr(catching_data, 'sleep', calls.append)
+        monkeypatch.setattr(catching_data, '_jittered', lambda seconds: seconds)
+        return calls
+    
+    @staticmethod
+    def response(remaining, reset, from_cache=False):
+        """Create a response stub with rate limit headers."""
+        headers = {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)}
+        return SimpleNamespace(headers=headers, from_cache=from_cache)
+    
+    def test_enough_remaining(self, slept):
+        """Test that no wait happens while enough requests remain."""
+        _pace_rate_limit(self.response(5, 30))
+        assert slept == []
+    
+    def test_reset_as_delta(self, slept):
+        """Test that a small reset value is treated as seconds until reset."""
+        _pace_rate_limit(self.response(1, 12))
+        assert slept == [12]
+    
+    def test_reset_as_epoch(self, slept):
+        """Test that a large reset value is treated as an epoch timestamp."""
+        reset = datetime.now(timezone.utc).timestamp() + 20
+        _pace_rate_limit(self.response(0, reset))
+        assert len(slept) == 1
+        assert 15 <= slept[0] <= 20
+    
+    def test_epoch_in_past(self, slept):
+        """Test that a reset time already passed means no wait."""
+        reset = datetime.now(timezone.utc).timestamp() - 20
+        _pace_rate_limit(self.response(0, reset))
+        assert slept == []
+    
+    def test_cached_response_ignored(self, slept):
+        """Test that headers replayed from the cache never cause a wait."""
+        _pace_rate_limit(self.response(0, 12, from_cache=True))
+        assert slept == []
+    
+    def test_missing_headers(self, slept):
+        """Test that responses without rate limit headers never wait."""
+        _pace_rate_limit(SimpleNamespace(headers={}))
+        assert slept == []
+
 # =========================
 # RUN TESTS
 # =========================